@@ -1,61 +1,283 @@
 from flask import Flask, jsonify, render_template, request
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime
+from operator import itemgetter
+import heapq
 import json
 import os
+import sys
+import threading
+import time
 
 app = Flask(__name__)
+# Réponses API compactes : sérialisation par l'encodeur C de json, même en debug
+app.json.compact = True
 
 # ============================
 # FONCTIONS UTILES INTERNES
 # ============================
 
+# Cache applicatif des fichiers JSON : chemin -> (mtime_ns, taille, données)
+_JSON_CACHE = {}
+_JSON_CACHE_LOCK = threading.Lock()
+# Encodeur compact partagé (json.dumps le recréerait à chaque sauvegarde)
+_JSON_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+# os.replace échoue sous Windows tant que l'autre processus a le fichier
+# ouvert : quelques nouvelles tentatives espacées avant d'abandonner
+REPLACE_RETRIES = 5
+REPLACE_RETRY_DELAY = 0.05
+
+
+def _default_for(path):
+    """Valeur par défaut selon le type de fichier (liste ou dictionnaire)"""
+    return [] if path in [EVENTS_FILE, LEGACY_EVENTS_FILE, ALERTS_FILE] else {}
+
+
 def load_json(path):
-    """Charge un fichier JSON en toute sécurité"""
-    if not os.path.exists(path):
-        if path in ["events.json", "alerts.json"]:
-            return []  
-        return {}      
+    """Charge un fichier JSON en toute sécurité.
+
+    Le résultat est mis en cache et n'est relu que si le mtime ou la taille
+    du fichier change. L'objet retourné est partagé : ne pas le modifier."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return _default_for(path)
+
+    key = (st.st_mtime_ns, st.st_size)
+    with _JSON_CACHE_LOCK:
+        cached = _JSON_CACHE.get(path)
+        if cached is not None and cached[:2] == key:
+            return cached[2]
 
+    # Clé prise sur le descripteur effectivement lu plutôt que sur le stat initial
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if path in ["events.json", "alerts.json"]:
-                return data if isinstance(data, list) else []
-            return data if isinstance(data, dict) else {}
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            key = (st.st_mtime_ns, st.st_size)
+            raw = f.read()
+        data = parse_jsonl(raw) if path.endswith(".jsonl") else json.loads(raw)
     except:
-        if path in ["events.json", "alerts.json"]:
-            return []
-        return {}
+        return _default_for(path)
+
+    if path in [EVENTS_FILE, LEGACY_EVENTS_FILE, ALERTS_FILE]:
+        data = data if isinstance(data, list) else []
+    else:
+        data = data if isinstance(data, dict) else {}
+
+    if path in [EVENTS_FILE, LEGACY_EVENTS_FILE]:
+        intern_event_fields(data)
+
+    with _JSON_CACHE_LOCK:
+        _JSON_CACHE[path] = (key[0], key[1], data)
+    return data
+
+
+def parse_jsonl(raw):
+    """Parse un fichier JSON Lines (un objet par ligne).
+
+    Les lignes illisibles, typiquement une dernière ligne en cours d'écriture
+    par le générateur, sont ignorées."""
+    items = []
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            continue
+    return items
+
+
+def events_file():
+    """Fichier d'événements courant : events.jsonl, sinon l'ancien events.json"""
+    return EVENTS_FILE if os.path.exists(EVENTS_FILE) else LEGACY_EVENTS_FILE
+
+
+# Champs d'événement à faible cardinalité (statut, pays, user-agent, ...)
+CATEGORICAL_FIELDS = ("status", "country", "ua", "user", "date")
+
+
+def intern_event_fields(events):
+    """Partage une seule instance de chaque valeur catégorielle.
+
+    json crée une chaîne par occurrence : après internement, les milliers de
+    "FAIL" ou de user-agents identiques pointent vers le même objet, ce qui
+    réduit la mémoire et réutilise le hash lors des comptages."""
+    for e in events:
+        if not isinstance(e, dict):
+            continue
+        for field in CATEGORICAL_FIELDS:
+            value = e.get(field)
+            if type(value) is str:
+                e[field] = sys.intern(value)
+
+
+def iter_events():
+    """Itère sur les événements sans construire de liste par requête.
+
+    S'appuie sur le cache de load_json : le fichier n'est relu et parsé
+    qu'après une modification, puis partagé par toutes les routes."""
+    for e in load_json(events_file()):
+        if isinstance(e, dict):
+            yield e
+
+
+# Agrégats des événements : (liste source en cache, résumé calculé)
+_EVENTS_SUMMARY = (None, None)
+
+
+def summarize_events():
+    """Agrège les événements en un seul passage, une fois par version du fichier.
+
+    Le résumé est recalculé uniquement quand load_json a reparsé les événements
+    (nouvelle liste), puis partagé par /stats et /api/statistics."""
+    global _EVENTS_SUMMARY
+    events = load_json(events_file())
+    source, summary = _EVENTS_SUMMARY
+    if source is events:
+        return summary
+    
+    total_events = 0
+    failed_logins = 0
+    success_logins = 0
+    countries = Counter()
+    ip_totals = Counter()
+    ip_failures = Counter()
+    for e in events:
+        if not isinstance(e, dict):
+            continue
+        total_events += 1
+        status = e.get("status")
+        if status == "FAIL":
+            failed_logins += 1
+        elif status == "SUCCESS":
+            success_logins += 1
+        
+        countries[e.get("country", "Unknown")] += 1
+        
+        ip = e.get("ip")
+        if ip:
+            ip_totals[ip] += 1
+            if status == "FAIL":
+                ip_failures[ip] += 1
+    
+    summary = {
+        "total_events": total_events,
+        "failed_logins": failed_logins,
+        "success_logins": success_logins,
+        "unique_ips": len(ip_totals),
+        "top_countries": top_n(countries.items()),
+        "top_ips_attempts": top_n(ip_totals.items()),
+        # Les IPs sans échec restent classées (à 0), comme auparavant
+        "top_ips_failures": top_n((ip, ip_failures[ip]) for ip in ip_totals),
+    }
+    _EVENTS_SUMMARY = (events, summary)
+    return summary
+
+
+def _replace_with_retry(tmp, path):
+    """os.replace, retenté sur PermissionError (fichier cible ouvert sous Windows)"""
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(tmp, path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY)
 
 
 def save_json(path, data):
-    """Sauvegarde JSON proprement"""
+    """Sauvegarde JSON proprement.
+
+    Écriture atomique : fichier temporaire voisin puis os.replace, pour que
+    les lectures concurrentes voient l'ancien ou le nouveau contenu."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        payload = _JSON_ENCODER.encode(data)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+        _replace_with_retry(tmp, path)
     except Exception as e:
         print(f"❌ Erreur sauvegarde {path}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    finally:
+        with _JSON_CACHE_LOCK:
+            _JSON_CACHE.pop(path, None)
+
+
+# Bornes inférieures de MEDIUM, HIGH et CRITICAL
+SEVERITY_BOUNDS = (31, 61, 86)
+SEVERITY_LABELS = ("LOW", "MEDIUM", "HIGH", "CRITICAL")
 
 
 def get_severity_level(score):
     """Détermine le niveau de sévérité selon le score."""
-    if score >= 86:
-        return "CRITICAL"
-    elif score >= 61:
-        return "HIGH"
-    elif score >= 31:
-        return "MEDIUM"
-    else:
-        return "LOW"
+    return SEVERITY_LABELS[bisect_right(SEVERITY_BOUNDS, score)]
+
+
+def count_severities(scores):
+    """Compte les menaces par niveau de sévérité."""
+    severity_counts = {"LOW": 0, "MEDIUM": 0, "HIGH": 0, "CRITICAL": 0}
+    if isinstance(scores, dict):
+        severity_counts.update(Counter(
+            score_data.get("severity", "LOW") for score_data in scores.values()
+        ))
+    return severity_counts
+
+
+def top_n(pairs, n=10):
+    """Les n paires (clé, compteur) les plus élevées, en O(len * log n)."""
+    return dict(heapq.nlargest(n, pairs, key=itemgetter(1)))
+
+
+def file_etag(*paths):
+    """ETag dérivé du mtime et de la taille des fichiers sources d'une réponse."""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+        except FileNotFoundError:
+            parts.append("0")
+    return ".".join(parts)
+
+
+def with_etag(response, etag):
+    """Ajoute l'ETag et impose la revalidation côté navigateur."""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def not_modified(etag):
+    """Réponse 304 : le client a déjà la version courante."""
+    return with_etag(app.response_class(status=304), etag)
 
 
 # ======================================
 # PATH DES FICHIERS
 # ======================================
-EVENTS_FILE = "events.json"
+EVENTS_FILE = "events.jsonl"          # journal écrit par le générateur
+LEGACY_EVENTS_FILE = "events.json"    # ancien format, lu si le journal est absent
 ALERTS_FILE = "alerts.json"
 SCORES_FILE = "threat_scores.json"
 SANCTIONS_FILE = "sanctions.json"
 
+EVENT_DEFAULTS = {
+    "country": "Unknown",
+    "ua": "-",
+    "status": "UNKNOWN",
+    "date": "",
+    "time": "",
+    "ip": "0.0.0.0",
+    "user": "unknown",
+}
+
 
 # ============================
 # ROUTES FRONTEND
@@ -85,19 +307,17 @@ def statistics_page():
 
 @app.route("/events")
 def get_events():
-    events = load_json(EVENTS_FILE)
+    path = events_file()
+    etag = file_etag(path)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    
+    events = load_json(path)
     
-    if isinstance(events, list):
-        for ev in events:
-            ev.setdefault("country", "Unknown")
-            ev.setdefault("ua", "-")
-            ev.setdefault("status", "UNKNOWN")
-            ev.setdefault("date", "")
-            ev.setdefault("time", "")
-            ev.setdefault("ip", "0.0.0.0")
-            ev.setdefault("user", "unknown")
+    # Copie avec valeurs par défaut : les événements en cache restent intacts
+    events = [{**EVENT_DEFAULTS, **ev} for ev in events]
     
-    return jsonify(events)
+    return with_etag(jsonify(events), etag)
 
 
 @app.route("/alerts")
@@ -108,34 +328,23 @@ def get_alerts():
 
 @app.route("/stats")
 def get_stats():
-    events = load_json(EVENTS_FILE)
     alerts = load_json(ALERTS_FILE)
     scores = load_json(SCORES_FILE)
     
-    if not isinstance(events, list):
-        events = []
-    
-    total_events = len(events)
-    failed_logins = len([e for e in events if e.get("status") == "FAIL"])
-    success_logins = len([e for e in events if e.get("status") == "SUCCESS"])
-    
-    # Compter les IPs uniques
-    unique_ips = len(set(e.get("ip") for e in events if e.get("ip")))
+    summary = summarize_events()
+    total_events = summary["total_events"]
+    success_logins = summary["success_logins"]
     
     # Compter les menaces par sévérité
-    severity_counts = {"LOW": 0, "MEDIUM": 0, "HIGH": 0, "CRITICAL": 0}
-    if isinstance(scores, dict):
-        for score_data in scores.values():
-            severity = score_data.get("severity", "LOW")
-            severity_counts[severity] = severity_counts.get(severity, 0) + 1
+    severity_counts = count_severities(scores)
     
     stats = {
         "total_events": total_events,
         "total_alerts": len(alerts) if isinstance(alerts, list) else 0,
-        "failed_logins": failed_logins,
+        "failed_logins": summary["failed_logins"],
         "success_logins": success_logins,
         "success_rate": round((success_logins / total_events * 100) if total_events else 0, 2),
-        "unique_ips": unique_ips,
+        "unique_ips": summary["unique_ips"],
         "total_threats": len(scores) if isinstance(scores, dict) else 0,
         "severity_counts": severity_counts
     }
@@ -150,20 +359,37 @@ def get_stats():
 @app.route("/api/scores")
 def get_scores():
     """Retourne tous les scores de menaces (agrégés par IP)"""
+    etag = file_etag(SCORES_FILE)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    
     scores = load_json(SCORES_FILE)
     print(f"📊 API /api/scores appelée - {len(scores) if isinstance(scores, dict) else 0} menaces")
-    return jsonify(scores)
+    return with_etag(jsonify(scores), etag)
 
 
-@app.route("/api/sanctions")
-def get_sanctions():
-    """Retourne toutes les sanctions actives"""
+# Sanctions nettoyées : (ETag des fichiers sources, résultat, prochaine expiration)
+_SANCTIONS_CACHE = (None, None, None)
+
+
+def clean_sanctions():
+    """Retire les sanctions obsolètes et corrige leur sévérité.
+
+    Le résultat est réutilisé tant que sanctions.json et threat_scores.json
+    n'ont pas changé et qu'aucune sanction conservée n'a expiré."""
+    global _SANCTIONS_CACHE
+    key = file_etag(SANCTIONS_FILE, SCORES_FILE)
+    cached_key, cached, next_expiry = _SANCTIONS_CACHE
+    if cached_key == key and (next_expiry is None or datetime.now() <= next_expiry):
+        return cached
+    
     sanctions = load_json(SANCTIONS_FILE)
     scores = load_json(SCORES_FILE)
     
     # Nettoyer les sanctions obsolètes
     cleaned = {}
     changed = False
+    next_expiry = None
     
     if isinstance(sanctions, dict):
         for entity, sanction in sanctions.items():
@@ -182,17 +408,18 @@ def get_sanctions():
             # Recalculer la sévérité pour corriger d'éventuelles incohérences
             correct_severity = get_severity_level(score)
             if sanction.get("severity") != correct_severity:
-                sanction["severity"] = correct_severity
+                sanction = {**sanction, "severity": correct_severity}
                 changed = True
             
             # Vérifier l'expiration
             if sanction.get("expires_at"):
                 try:
-                    from datetime import datetime
                     expires = datetime.fromisoformat(sanction["expires_at"])
                     if datetime.now() > expires:
                         changed = True
                         continue
+                    if next_expiry is None or expires < next_expiry:
+                        next_expiry = expires
                 except:
                     pass
             
@@ -201,8 +428,23 @@ def get_sanctions():
     if changed:
         save_json(SANCTIONS_FILE, cleaned)
     
+    # Clé relue après une éventuelle réécriture de sanctions.json
+    _SANCTIONS_CACHE = (file_etag(SANCTIONS_FILE, SCORES_FILE), cleaned, next_expiry)
+    return cleaned
+
+
+@app.route("/api/sanctions")
+def get_sanctions():
+    """Retourne toutes les sanctions actives"""
+    cleaned = clean_sanctions()
+    
+    # ETag calculé après le nettoyage, qui peut réécrire sanctions.json
+    etag = file_etag(SANCTIONS_FILE, SCORES_FILE)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    
     print(f"📊 API /api/sanctions appelée - {len(cleaned)} sanctions actives")
-    return jsonify(cleaned)
+    return with_etag(jsonify(cleaned), etag)
 
 
 @app.route("/api/ip-details")
@@ -225,76 +467,26 @@ def get_ip_details():
 @app.route("/api/statistics")
 def get_advanced_statistics():
     """Statistiques avancées pour la page statistics"""
-    events = load_json(EVENTS_FILE)
     alerts = load_json(ALERTS_FILE)
     scores = load_json(SCORES_FILE)
     
-    if not isinstance(events, list):
-        events = []
     if not isinstance(alerts, list):
         alerts = []
     
-    # Agrégation par pays
-    countries = {}
-    for e in events:
-        c = e.get("country", "Unknown")
-        countries[c] = countries.get(c, 0) + 1
-    
-    # Agrégation par IP
-    ip_stats = {}
-    for e in events:
-        ip = e.get("ip")
-        if not ip:
-            continue
-        
-        if ip not in ip_stats:
-            ip_stats[ip] = {
-                "total": 0,
-                "failed": 0,
-                "success": 0,
-                "users": set()
-            }
-        
-        ip_stats[ip]["total"] += 1
-        if e.get("status") == "FAIL":
-            ip_stats[ip]["failed"] += 1
-        elif e.get("status") == "SUCCESS":
-            ip_stats[ip]["success"] += 1
-        
-        user = e.get("user")
-        if user:
-            ip_stats[ip]["users"].add(user)
-    
-    # Top IPs par nombre de tentatives
-    top_ips_attempts = sorted(
-        [(ip, data["total"]) for ip, data in ip_stats.items()],
-        key=lambda x: x[1],
-        reverse=True
-    )[:10]
-    
-    # Top IPs par nombre d'échecs
-    top_ips_failures = sorted(
-        [(ip, data["failed"]) for ip, data in ip_stats.items()],
-        key=lambda x: x[1],
-        reverse=True
-    )[:10]
+    summary = summarize_events()
     
     # Scores par sévérité
-    severity_counts = {"LOW": 0, "MEDIUM": 0, "HIGH": 0, "CRITICAL": 0}
-    if isinstance(scores, dict):
-        for score_data in scores.values():
-            severity = score_data.get("severity", "LOW")
-            severity_counts[severity] = severity_counts.get(severity, 0) + 1
+    severity_counts = count_severities(scores)
     
     return jsonify({
-        "total_events": len(events),
+        "total_events": summary["total_events"],
         "total_alerts": len(alerts),
         "total_threats": len(scores) if isinstance(scores, dict) else 0,
-        "unique_ips": len(ip_stats),
+        "unique_ips": summary["unique_ips"],
         "threats_by_severity": severity_counts,
-        "top_countries": dict(sorted(countries.items(), key=lambda x: x[1], reverse=True)[:10]),
-        "top_ips_attempts": dict(top_ips_attempts),
-        "top_ips_failures": dict(top_ips_failures)
+        "top_countries": summary["top_countries"],
+        "top_ips_attempts": summary["top_ips_attempts"],
+        "top_ips_failures": summary["top_ips_failures"]
     })
 
 
@@ -316,7 +508,8 @@ def remove_sanction():
         return jsonify({"success": False, "error": "Sanction not found"}), 404
     
     # Marquer comme inactive au lieu de supprimer
-    sanctions[key]["active"] = False
+    sanctions = dict(sanctions)
+    sanctions[key] = {**sanctions[key], "active": False}
     save_json(SANCTIONS_FILE, sanctions)
     
     print(f"🔓 Sanction levée: {key}")
@@ -325,6 +518,9 @@ def remove_sanction():
         "success": True,
         "message": f"Sanction levée pour {s_type}: {value}"
     })
+
+
+@app.route("/api/events-by-ip")
 def get_events_by_ip():
     """Retourne tous les événements pour une IP donnée"""
     ip = request.args.get("ip")
@@ -332,12 +528,7 @@ def get_events_by_ip():
     if not ip:
         return jsonify({"error": "Missing IP parameter"}), 400
     
-    events = load_json(EVENTS_FILE)
-    
-    if not isinstance(events, list):
-        return jsonify([])
-    
-    ip_events = [e for e in events if e.get("ip") == ip]
+    ip_events = [e for e in iter_events() if e.get("ip") == ip]
     
     return jsonify(ip_events)
 
@@ -8,15 +8,23 @@ import json
 import os
 import random
 import datetime
+import ipaddress
 import time
 from datetime import datetime as dt, timedelta
-from collections import defaultdict
+from bisect import bisect_right
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import accumulate, islice
+from operator import itemgetter
 import math
+import sys
 
 # ================================
 # FICHIERS
 # ================================
-EVENTS_FILE = "events.json"
+EVENTS_FILE = "events.jsonl"          # un événement JSON par ligne
+LEGACY_EVENTS_FILE = "events.json"    # ancien format : tableau JSON complet
 ALERT_FILE = "alerts.json"
 SCORES_FILE = "threat_scores.json"
 SANCTIONS_FILE = "sanctions.json"
@@ -38,16 +46,18 @@ DETECTION_CFG = {
     "USER_SPREAD_THRESHOLD": 4,
     "MIN_BOT_SPEED": 0.25,
     "PERSISTENCE_MINUTES": 15,
-    "HIGH_VALUE_TARGETS": ["admin", "root", "security", "finance", "backup", "superuser", "dbadmin"],
+    "HIGH_VALUE_TARGETS": frozenset({"admin", "root", "security", "finance", "backup", "superuser", "dbadmin"}),
 }
 
-SUSPICIOUS_USER_AGENTS = [
+SUSPICIOUS_USER_AGENTS = frozenset({
     "hydra", "sqlmap", "masscan", "nikto", "nmap",
     "burp", "metasploit", "python-requests", "curl", "wget"
-]
+})
+# Une seule passe sur le user-agent pour toutes les signatures
+SUSPICIOUS_UA_RE = re.compile("|".join(re.escape(bot) for bot in sorted(SUSPICIOUS_USER_AGENTS)))
 
-HIGH_RISK_COUNTRIES = ["RU", "CN", "KP", "BR"]
-MEDIUM_RISK_COUNTRIES = ["US", "MO"]
+HIGH_RISK_COUNTRIES = frozenset({"RU", "CN", "KP", "BR"})
+MEDIUM_RISK_COUNTRIES = frozenset({"US", "MO"})
 
 SEVERITY_LEVELS = {
     "CRITICAL": (86, 100),
@@ -55,6 +65,9 @@ SEVERITY_LEVELS = {
     "MEDIUM": (31, 60),
     "LOW": (0, 30)
 }
+# Niveaux du plus faible au plus fort, et bornes inférieures des niveaux > LOW
+SEVERITY_LABELS = tuple(sorted(SEVERITY_LEVELS, key=lambda level: SEVERITY_LEVELS[level][0]))
+SEVERITY_BOUNDS = tuple(SEVERITY_LEVELS[level][0] for level in SEVERITY_LABELS[1:])
 
 SANCTIONS = {
     "MEDIUM": {
@@ -79,28 +92,114 @@ SANCTIONS = {
     }
 }
 
+# Persistance des événements par lots : sauvegarde tous les N événements
+# ou après un délai, au lieu de réécrire le fichier à chaque événement
+SAVE_BATCH_SIZE = 25
+SAVE_INTERVAL_SECONDS = 2.0
+
+# Remplacement atomique : sous Windows, os.replace échoue tant que le
+# dashboard a le fichier ouvert ; quelques nouvelles tentatives espacées
+REPLACE_RETRIES = 5
+REPLACE_RETRY_DELAY = 0.05
+
+# Historique conservé, et réécriture complète du journal JSONL tous les
+# ROTATE_EVERY événements ajoutés (entre deux, simple ajout en fin de fichier)
+MAX_EVENTS = 2000
+ROTATE_EVERY = 500
+
+# Affichage console par lots : une écriture sur stdout toutes les N lignes
+# ou après un délai, au lieu d'un print (et d'un flush) par événement
+CONSOLE_BATCH_SIZE = 16
+CONSOLE_INTERVAL_SECONDS = 1.0
+
+# Cadencement : retard maximal rattrapé (au-delà, l'échéancier repart de
+# maintenant au lieu d'enchaîner une longue rafale d'événements sans pause)
+MAX_CATCHUP_SECONDS = 5.0
+
 # ================================
 # UTILITAIRES I/O JSON
 # ================================
+# Encodeur compact partagé : json.dumps avec des options non par défaut
+# recrée un JSONEncoder à chaque appel, ici instancié une seule fois
+JSON_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+encode_json = JSON_ENCODER.encode
+
 def load_json(path):
     if not os.path.exists(path):
         return {} if path in [SCORES_FILE, SANCTIONS_FILE] else []
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return json.loads(f.read())
     except Exception as e:
         print(f"⚠️ Erreur chargement {path}: {e}")
         return {} if path in [SCORES_FILE, SANCTIONS_FILE] else []
 
 def save_json(path, data):
+    write_atomic(path, encode_json(data))
+
+def replace_with_retry(tmp, path):
+    """os.replace, retenté sur PermissionError (fichier cible ouvert sous Windows)"""
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(tmp, path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(REPLACE_RETRY_DELAY)
+
+def write_atomic(path, payload):
+    # Écriture atomique : fichier temporaire voisin puis os.replace,
+    # le dashboard ne lit jamais un fichier à moitié écrit.
+    # Retourne False si l'écriture a échoué (l'ancien fichier reste intact)
+    tmp = f"{path}.{os.getpid()}.tmp"
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+        replace_with_retry(tmp, path)
+        return True
     except Exception as e:
         print(f"⚠️ Erreur sauvegarde {path}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+def events_to_jsonl(events):
+    return "".join([event_to_jsonl(e) for e in events])
+
+def iter_events():
+    """Parcourt l'historique de events.jsonl ligne par ligne (ou l'ancien
+    events.json) : chargé dans une deque bornée, seuls les MAX_EVENTS
+    derniers événements restent en mémoire."""
+    if not os.path.exists(EVENTS_FILE):
+        events = load_json(LEGACY_EVENTS_FILE)
+        if isinstance(events, list):
+            yield from events
+        return
+    loads = json.loads
+    try:
+        with open(EVENTS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield loads(line)
+                except ValueError:
+                    continue  # ligne incomplète (arrêt pendant une écriture)
+    except Exception as e:
+        print(f"⚠️ Erreur chargement {EVENTS_FILE}: {e}")
 
 def parse_datetime(date_str, time_str):
     s = f"{date_str} {time_str}"
+    # Chemin rapide : fromisoformat (en C) couvre le format écrit par le générateur.
+    # Résultat gardé seulement s'il est naïf : un décalage horaire (+00:00, Z)
+    # donnerait un datetime « aware » impossible à comparer aux autres
+    try:
+        t = dt.fromisoformat(s)
+        if t.tzinfo is None:
+            return t
+    except ValueError:
+        pass
     for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
         try:
             return dt.strptime(s, fmt)
@@ -108,26 +207,42 @@ def parse_datetime(date_str, time_str):
             continue
     return dt.now()
 
+def trimmed_avg_diff(times):
+    """Moyenne tronquée (10% de chaque côté) des intervalles en secondes
+    entre horodatages triés. Retourne None s'il n'y a aucun intervalle."""
+    diffs = sorted((b - a).total_seconds() for a, b in zip(times, islice(times, 1, None)))
+    n = len(diffs)
+    cut = max(1, int(n * 0.1))
+    trimmed = diffs[cut:n - cut] if n > 2 * cut else diffs
+    if not trimmed:
+        return None
+    return sum(trimmed) / len(trimmed)
+
+@lru_cache(maxsize=1024)
+def is_suspicious_ua(ua):
+    """Indique si le user-agent contient une signature d'outil automatisé.
+    Mis en cache : les IPs partagent un petit nombre de user-agents."""
+    return SUSPICIOUS_UA_RE.search(ua.lower()) is not None
+
 # ================================
 # SEVERITY - FONCTION CORRIGÉE
 # ================================
 def get_severity_level(score):
     """Détermine le niveau de sévérité selon le score.
-    CORRECTION: Utilise >= pour gérer correctement les scores comme 85.97"""
-    if score >= 86:
-        return "CRITICAL"
-    elif score >= 61:
-        return "HIGH"
-    elif score >= 31:
-        return "MEDIUM"
-    else:
-        return "LOW"
+    CORRECTION: Utilise >= pour gérer correctement les scores comme 85.97
+    (bisect_right : un score égal à une borne passe au niveau supérieur)"""
+    return SEVERITY_LABELS[bisect_right(SEVERITY_BOUNDS, score)]
 
 # ================================
 # CALCUL SCORE PAR IP
 # ================================
 def calculate_threat_score_ip(events, ip):
     """Calcule le score de menace pour une IP spécifique"""
+    ip_events = [e for e in events if e.get("ip") == ip]
+    return score_ip_events(ip_events)
+
+def score_ip_events(ip_events):
+    """Calcule le score de menace à partir des événements déjà regroupés d'une IP"""
     score_components = {
         "failed_attempts": 0,
         "attack_speed": 0,
@@ -138,7 +253,6 @@ def calculate_threat_score_ip(events, ip):
     }
     reasons = []
 
-    ip_events = [e for e in events if e.get("ip") == ip]
     if not ip_events:
         return 0, [], score_components, {}
 
@@ -148,15 +262,19 @@ def calculate_threat_score_ip(events, ip):
         "total_attempts": len(recent),
         "failed_attempts": 0,
         "success_attempts": 0,
-        "unique_users": set(),
-        "countries": set(),
-        "user_agents": set(),
-        "targeted_hvt": set(),
+        # dict utilisé comme ensemble ordonné (ordre de première apparition)
+        "unique_users": {},
+        "countries": {},
+        "user_agents": {},
+        "targeted_hvt": {},
         "first_seen": None,
         "last_seen": None
     }
 
     times = []
+    # Premier user-agent d'outil automatisé : drapeau posé à la génération,
+    # recalculé depuis le user-agent pour les événements plus anciens
+    bot_ua = None
     for e in recent:
         if e.get("status") == "FAIL":
             aggregated_stats["failed_attempts"] += 1
@@ -165,17 +283,23 @@ def calculate_threat_score_ip(events, ip):
         
         user = e.get("user")
         if user:
-            aggregated_stats["unique_users"].add(user)
+            aggregated_stats["unique_users"][user] = None
             if user in DETECTION_CFG["HIGH_VALUE_TARGETS"]:
-                aggregated_stats["targeted_hvt"].add(user)
+                aggregated_stats["targeted_hvt"][user] = None
         
         country = e.get("country")
         if country:
-            aggregated_stats["countries"].add(country)
+            aggregated_stats["countries"][country] = None
         
         ua = e.get("ua")
         if ua:
-            aggregated_stats["user_agents"].add(ua)
+            aggregated_stats["user_agents"][ua] = None
+        if bot_ua is None:
+            is_bot_ua = e.get("is_bot_ua")
+            if is_bot_ua is None:
+                is_bot_ua = bool(ua) and is_suspicious_ua(ua)
+            if is_bot_ua:
+                bot_ua = ua or "?"
         
         try:
             t = parse_datetime(e.get("date", ""), e.get("time", ""))
@@ -185,8 +309,8 @@ def calculate_threat_score_ip(events, ip):
 
     times = sorted(times)
     if times:
-        aggregated_stats["first_seen"] = times[0].strftime("%Y-%m-%d %H:%M:%S")
-        aggregated_stats["last_seen"] = times[-1].strftime("%Y-%m-%d %H:%M:%S")
+        aggregated_stats["first_seen"] = times[0].isoformat(sep=" ", timespec="seconds")
+        aggregated_stats["last_seen"] = times[-1].isoformat(sep=" ", timespec="seconds")
 
     aggregated_stats["unique_users"] = list(aggregated_stats["unique_users"])
     aggregated_stats["countries"] = list(aggregated_stats["countries"])
@@ -206,12 +330,8 @@ def calculate_threat_score_ip(events, ip):
 
     # Attack speed
     if len(times) >= 3:
-        diffs = [(times[i]-times[i-1]).total_seconds() for i in range(1, len(times))]
-        diffs_sorted = sorted(diffs)
-        cut = max(1, int(len(diffs_sorted)*0.1))
-        trimmed = diffs_sorted[cut:len(diffs_sorted)-cut] if len(diffs_sorted) > 2*cut else diffs_sorted
-        if trimmed:
-            avg = sum(trimmed)/len(trimmed)
+        avg = trimmed_avg_diff(times)
+        if avg is not None:
             w = SCORING_WEIGHTS["attack_speed"]
             if avg < 0.25:
                 score_components["attack_speed"] = w
@@ -223,13 +343,10 @@ def calculate_threat_score_ip(events, ip):
                 score_components["attack_speed"] = round(w * 0.5, 2)
                 reasons.append(f"Attaque modérée ({avg:.2f}s/req)")
 
-    # Tool detection
-    for ua in aggregated_stats["user_agents"]:
-        ua_l = ua.lower()
-        if any(bot in ua_l for bot in SUSPICIOUS_USER_AGENTS):
-            score_components["tool_detection"] = SCORING_WEIGHTS["tool_detection"]
-            reasons.append(f"Outil automatisé: {ua[:40]}")
-            break
+    # Tool detection (user-agent repéré pendant l'agrégation)
+    if bot_ua is not None:
+        score_components["tool_detection"] = SCORING_WEIGHTS["tool_detection"]
+        reasons.append(f"Outil automatisé: {bot_ua[:40]}")
 
     # Geographic risk
     geo_score = 0
@@ -276,23 +393,18 @@ def calculate_threat_score_ip(events, ip):
     return min(score, 100), reasons, score_components, aggregated_stats
 
 # ================================
-# APPLY SANCTION - VERSION CORRIGÉE
+# BUILD SANCTION - VERSION CORRIGÉE
 # ================================
-def apply_sanction(entity_type, value, score, severity, reasons, components):
-    """Applique une sanction basée sur le score et la sévérité
-    CORRECTION: Vérifie d'abord si la sévérité existe dans SANCTIONS"""
+def build_sanction(entity_type, value, score, severity, reasons, components):
+    """Construit la sanction basée sur le score et la sévérité, sans l'écrire.
+    Retourne None si aucune sanction n'est définie pour cette sévérité."""
     
     # Vérification de sévérité
     if severity not in SANCTIONS:
         print(f"⚠️ Aucune sanction définie pour sévérité: {severity} (score: {score})")
-        return
-    
-    sanctions = load_json(SANCTIONS_FILE)
-    if not isinstance(sanctions, dict):
-        sanctions = {}
+        return None
     
     sanction_config = SANCTIONS[severity]
-    key = f"{entity_type}:{value}"
     now = dt.now()
     
     expires_at = None
@@ -320,32 +432,57 @@ def apply_sanction(entity_type, value, score, severity, reasons, components):
     if sanction_config.get("requires_manual_review"):
         sanction["requires_manual_review"] = True
     
-    sanctions[key] = sanction
-    save_json(SANCTIONS_FILE, sanctions)
-    
     emoji = {"MEDIUM": "🟡", "HIGH": "🟠", "CRITICAL": "🔴"}.get(severity, "⚪")
     print(f"{emoji} Sanction: {value} → {sanction_config['action']} | Score: {score} | {severity}")
+    return sanction
 
 # ================================
 # DETECTION PAR IP - VERSION CORRIGÉE
 # ================================
+# État par IP conservé entre deux passes : ip -> (signature de la fenêtre, résultat)
+_IP_STATE = {}
+
+def score_ip_cached(ip, ip_events):
+    """Score d'une IP, recalculé uniquement si sa fenêtre d'événements a changé.
+    La signature compare par identité le premier et le dernier événement."""
+    first, last = ip_events[0], ip_events[-1]
+    state = _IP_STATE.get(ip)
+    if state is not None:
+        (count, s_first, s_last), result = state
+        if count == len(ip_events) and s_first is first and s_last is last:
+            return result
+
+    result = score_ip_events(ip_events)
+    _IP_STATE[ip] = ((len(ip_events), first, last), result)
+    return result
+
 def detect_threats_by_ip(events):
     """Détecte les menaces en analysant chaque IP
     CORRECTION: Applique maintenant les sanctions MEDIUM correctement"""
     alerts = load_json(ALERT_FILE)
     scores = load_json(SCORES_FILE)
+    sanctions = load_json(SANCTIONS_FILE)
 
     if not isinstance(alerts, list):
         alerts = []
     if not isinstance(scores, dict):
         scores = {}
+    if not isinstance(sanctions, dict):
+        sanctions = {}
+    sanctions_changed = False
 
-    latest = events[-1000:]
+    # Regroupement par IP en un seul passage sur l'historique complet
+    events_by_ip = defaultdict(list)
+    for e in events:
+        ip = e.get("ip")
+        if ip and not is_local_ip(ip):
+            events_by_ip[ip].append(e)
     
+    # Les 1000 derniers événements, filtrés pendant l'itération (sans copie)
     ip_groups = defaultdict(list)
-    for e in latest:
+    for e in islice(events, max(0, len(events) - 1000), None):
         ip = e.get("ip")
-        if ip and ip not in LOCAL_IPS:
+        if ip and not is_local_ip(ip):
             ip_groups[ip].append(e)
 
     alerted_ips = {a.get("ip") for a in alerts if a.get("type") == "Threat Detection"}
@@ -354,7 +491,7 @@ def detect_threats_by_ip(events):
         if len(ip_events) < 3:
             continue
         
-        score, reasons, components, stats = calculate_threat_score_ip(events, ip)
+        score, reasons, components, stats = score_ip_cached(ip, events_by_ip[ip])
         severity = get_severity_level(score)
         
         # MODIFICATION: Traiter tous les scores >= 31 (MEDIUM, HIGH, CRITICAL)
@@ -371,7 +508,10 @@ def detect_threats_by_ip(events):
             
             # Appliquer sanction pour MEDIUM, HIGH et CRITICAL
             print(f"📊 Traitement IP {ip}: Score={score}, Sévérité={severity}")
-            apply_sanction("IP", ip, score, severity, reasons, components)
+            sanction = build_sanction("IP", ip, score, severity, reasons, components)
+            if sanction is not None:
+                sanctions[f"IP:{ip}"] = sanction
+                sanctions_changed = True
             
             if ip not in alerted_ips:
                 sample = ip_events[-1]
@@ -390,8 +530,47 @@ def detect_threats_by_ip(events):
                 })
                 alerted_ips.add(ip)
 
+    # Oublier les IPs sorties de l'historique
+    for ip in [ip for ip in _IP_STATE if ip not in events_by_ip]:
+        del _IP_STATE[ip]
+
+    # Une seule écriture par fichier et par passe de détection
     save_json(ALERT_FILE, alerts)
     save_json(SCORES_FILE, scores)
+    if sanctions_changed:
+        save_json(SANCTIONS_FILE, sanctions)
+
+# Détection en tâche de fond : un seul worker, une seule passe à la fois
+_DETECTION_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detection")
+_DETECTION_STATE = {"future": None}
+
+def submit_detection(events):
+    """Lance detect_threats_by_ip sur une copie de l'historique sans bloquer
+    la génération. Si une passe est encore en cours, celle-ci est sautée :
+    la suivante verra de toute façon les nouveaux événements."""
+    future = _DETECTION_STATE["future"]
+    if future is not None and not future.done():
+        return False
+    future = _DETECTION_POOL.submit(detect_threats_by_ip, list(events))
+    future.add_done_callback(report_detection_error)
+    _DETECTION_STATE["future"] = future
+    return True
+
+def report_detection_error(future):
+    """Affiche l'erreur d'une passe de détection : sans cela, l'exception
+    resterait dans le future et la passe échouerait en silence."""
+    if future.cancelled():
+        return
+    e = future.exception()
+    if e is not None:
+        print(f"⚠️ Erreur détection: {type(e).__name__}: {e}")
+
+def wait_detection():
+    """Attend la fin de la passe de détection en cours (à l'arrêt).
+    Une éventuelle erreur est déjà affichée par report_detection_error."""
+    future = _DETECTION_STATE["future"]
+    if future is not None:
+        wait([future])
 
 # ================================
 # GÉNÉRATEUR DE LOGS
@@ -401,7 +580,7 @@ LEGIT_USERS = [
     "karim", "noura", "hassan", "amina", "samir", "leila",
     "mohamed", "sanae", "oussama"
 ]
-HIGH_VALUE_TARGETS = DETECTION_CFG["HIGH_VALUE_TARGETS"] + ["operator", "itmanager", "developer"]
+HIGH_VALUE_TARGETS = sorted(DETECTION_CFG["HIGH_VALUE_TARGETS"]) + ["operator", "itmanager", "developer"]
 
 USER_AGENTS_HUMANS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/122.0",
@@ -418,6 +597,54 @@ USER_AGENTS_BOTS = [
     "masscan/1.3"
 ]
 
+# Pools de tirage construits une seule fois : tous les comptes, et
+# user-agents indexés par un booléen "bot" (UA_POOLS[True] -> bots)
+USERS_POOL = tuple(LEGIT_USERS + HIGH_VALUE_TARGETS)
+UA_POOLS = (USER_AGENTS_HUMANS, USER_AGENTS_BOTS)
+
+# Champs d'un événement généré, dans l'ordre écrit par event_to_jsonl
+EVENT_KEYS = ("date", "time", "ip", "user", "status", "ua", "country", "is_bot_ua")
+
+def emit_event(events, stamp, ip, user, status, ua, country, is_bot_ua):
+    """Construit un événement à partir de stamp (AAAA-MM-JJ HH:MM:SS.mmm),
+    l'ajoute à events et le retourne. Point de création unique pour les
+    rafales comme pour la boucle principale."""
+    event = {
+        "date": stamp[:10],
+        "time": stamp[11:],
+        "ip": ip,
+        "user": user,
+        "status": status,
+        "ua": ua,
+        "country": country,
+        "is_bot_ua": is_bot_ua
+    }
+    events.append(event)
+    return event
+
+# Sérialisation directe des événements générés : gabarit de ligne construit
+# une fois depuis EVENT_KEYS (champs texte puis drapeau is_bot_ua), sans
+# parcours générique de l'encodeur JSON
+EVENT_KEY_SET = frozenset(EVENT_KEYS)
+EVENT_TEXT_KEYS = tuple(k for k in EVENT_KEYS if k != "is_bot_ua")
+json_str = json.encoder.encode_basestring   # chaîne JSON entre guillemets, non-ASCII conservé
+get_event_text = itemgetter(*EVENT_TEXT_KEYS)
+EVENT_LINE_FORMAT = "{{" + ",".join(
+    json_str(k) + ":{}" for k in EVENT_TEXT_KEYS + ("is_bot_ua",)
+) + "}}\n"
+
+def event_to_jsonl(e):
+    """Ligne JSONL d'un événement. Les événements au format de emit_event
+    passent par le gabarit ; les autres (historique ancien) par l'encodeur."""
+    flag = e.get("is_bot_ua")
+    if type(flag) is bool and e.keys() == EVENT_KEY_SET:
+        try:
+            return EVENT_LINE_FORMAT.format(*map(json_str, get_event_text(e)),
+                                            "true" if flag else "false")
+        except TypeError:
+            pass  # champ non textuel : encodeur générique
+    return encode_json(e) + "\n"
+
 COUNTRIES = {
     "MO": ["41.248", "102.55", "105.158", "154.70"],
     "FR": ["5.39", "51.83", "151.80", "185.22"],
@@ -429,152 +656,258 @@ COUNTRIES = {
     "NL": ["5.150", "185.53", "77.88"]
 }
 
+# Table plate (préfixe, pays, octets à compléter) tirée en un seul random.choice.
+# Chaque liste de pays est répétée jusqu'au PPCM des tailles : chaque pays garde
+# la même probabilité qu'avec un tirage pays puis préfixe.
+_PREFIX_REPEAT = math.lcm(*(len(prefixes) for prefixes in COUNTRIES.values()))
+PREFIX_TABLE = tuple(
+    (prefix, country, 4 - len(prefix.split('.')))
+    for country, prefixes in COUNTRIES.items()
+    for prefix in prefixes * (_PREFIX_REPEAT // len(prefixes))
+)
+
 LOCAL_IPS = ["192.168.1.10", "192.168.1.15", "192.168.1.50", "10.0.0.7"]
 
+@lru_cache(maxsize=8192)
+def is_local_ip(ip):
+    """IP privée ou locale (LAN, loopback), exclue de la détection.
+    Mis en cache : les mêmes IPs reviennent dans de nombreux événements."""
+    try:
+        return ipaddress.ip_address(ip).is_private
+    except ValueError:
+        return False
+
 def random_public_ip():
     """Génère une IP complète à 4 octets (A.B.C.D)"""
-    country = random.choice(list(COUNTRIES.keys()))
-    prefix = random.choice(COUNTRIES[country])
-    
-    parts = prefix.split('.')
-    octets_needed = 4 - len(parts)
+    prefix, country, octets_needed = random.choice(PREFIX_TABLE)
+    randint = random.randint
     
-    for _ in range(octets_needed):
-        parts.append(str(random.randint(1, 254)))
+    # Cas courant (préfixe A.B) : formatage direct, sans split/append/join
+    if octets_needed == 2:
+        return f"{prefix}.{randint(1, 254)}.{randint(1, 254)}", country
     
+    parts = [prefix] + [str(randint(1, 254)) for _ in range(octets_needed)]
     return '.'.join(parts), country
 
+def burst_timeline(attempts, base, delay_min, delay_max, fail_rate):
+    """Partie numérique d'une rafale : horodatages et statuts des tentatives.
+    Délais tirés comme uniform(delay_min, delay_max), tous d'un bloc,
+    puis les décalages cumulés sont convertis en datetime une fois chacun."""
+    rnd = random.random
+    span = delay_max - delay_min   # uniform(a, b) = a + (b-a)*random()
+    deltas = [delay_min + span * rnd() for _ in range(attempts)]
+    statuses = ["FAIL" if rnd() < fail_rate else "SUCCESS" for _ in range(attempts)]
+    fromtimestamp = dt.fromtimestamp
+    # Un seul formatage : "AAAA-MM-JJ HH:MM:SS.mmm" découpé en date / heure
+    stamps = [fromtimestamp(base + offset).isoformat(sep=" ", timespec="milliseconds")
+              for offset in accumulate(deltas)]
+    return stamps, statuses
+
 def generate_credential_stuffing_burst(events, attempts=40):
     ip, country = random_public_ip()
     ua = random.choice(USER_AGENTS_BOTS)
-    timestamp = dt.now()
-    users_pool = LEGIT_USERS + HIGH_VALUE_TARGETS
+    is_bot_ua = is_suspicious_ua(ua)
     
-    for i in range(attempts):
-        user = random.choice(users_pool)
-        delta = random.uniform(0.08, 0.8)
-        timestamp += timedelta(seconds=delta)
-        status = "FAIL" if random.random() < 0.88 else "SUCCESS"
-        
-        event = {
-            "date": timestamp.strftime("%Y-%m-%d"),
-            "time": timestamp.strftime("%H:%M:%S.%f")[:-3],
-            "ip": ip,
-            "user": user,
-            "status": status,
-            "ua": ua,
-            "country": country
-        }
-        events.append(event)
+    stamps, statuses = burst_timeline(attempts, time.time(), 0.08, 0.8, 0.88)
+    users = random.choices(USERS_POOL, k=attempts)
+    
+    for stamp, status, user in zip(stamps, statuses, users):
+        emit_event(events, stamp, ip, user, status, ua, country, is_bot_ua)
     
     return events
 
 def generate_moderate_attack(events, attempts=15):
     ip, country = random_public_ip()
-    user = random.choice(HIGH_VALUE_TARGETS + LEGIT_USERS)
-    ua = random.choice(USER_AGENTS_BOTS if random.random() < 0.7 else USER_AGENTS_HUMANS)
-    timestamp = dt.now()
+    user = random.choice(USERS_POOL)
+    ua = random.choice(UA_POOLS[random.random() < 0.7])
+    is_bot_ua = is_suspicious_ua(ua)
     
-    for i in range(attempts):
-        delta = random.uniform(0.5, 2.0)
-        timestamp += timedelta(seconds=delta)
-        status = "FAIL" if random.random() < 0.85 else "SUCCESS"
-        
-        event = {
-            "date": timestamp.strftime("%Y-%m-%d"),
-            "time": timestamp.strftime("%H:%M:%S.%f")[:-3],
-            "ip": ip,
-            "user": user,
-            "status": status,
-            "ua": ua,
-            "country": country
-        }
-        events.append(event)
+    stamps, statuses = burst_timeline(attempts, time.time(), 0.5, 2.0, 0.85)
+    
+    for stamp, status in zip(stamps, statuses):
+        emit_event(events, stamp, ip, user, status, ua, country, is_bot_ua)
     
     return events
 
+# Journal d'événements : lot en attente, fichier ouvert en ajout,
+# événements ajoutés depuis la dernière réécriture complète
+_SAVE_STATE = {"pending": [], "last_save": 0.0, "since_rotate": 0, "fh": None}
+
+def rewrite_events_file(events):
+    """Réécrit events.jsonl avec les MAX_EVENTS derniers événements.
+    Retourne False en cas d'échec : le compteur de rotation est conservé."""
+    close_events_file()
+    if not write_atomic(EVENTS_FILE, events_to_jsonl(islice(events, max(0, len(events) - MAX_EVENTS), None))):
+        return False
+    _SAVE_STATE["since_rotate"] = 0
+    return True
+
+def close_events_file():
+    if _SAVE_STATE["fh"] is not None:
+        _SAVE_STATE["fh"].close()
+        _SAVE_STATE["fh"] = None
+
+def flush_events(events, new_events, force=False):
+    """Ajoute new_events au journal : écriture si le lot est plein, si le
+    délai est dépassé ou si force=True (avant une détection, à l'arrêt).
+    events est l'historique complet, utilisé pour la réécriture périodique."""
+    state = _SAVE_STATE
+    pending = state["pending"]
+    pending.extend(new_events)
+    if not force and len(pending) < SAVE_BATCH_SIZE \
+            and time.time() - state["last_save"] <= SAVE_INTERVAL_SECONDS:
+        return
+
+    # Réécriture périodique ; si elle échoue, le lot est ajouté en fin de
+    # fichier comme d'habitude pour ne pas laisser de trou dans le journal
+    rotated = state["since_rotate"] + len(pending) >= ROTATE_EVERY and rewrite_events_file(events)
+    if not rotated and pending:
+        if state["fh"] is None:
+            state["fh"] = open(EVENTS_FILE, "a", encoding="utf-8", buffering=64 * 1024)
+        state["fh"].write(events_to_jsonl(pending))
+        state["fh"].flush()
+        state["since_rotate"] += len(pending)
+    pending.clear()
+    state["last_save"] = time.time()
+
+def flush_before_wait(events, wait_seconds):
+    """Avant une pause plus longue que SAVE_INTERVAL_SECONDS, écrit le lot en
+    attente : sinon il n'atteindrait le disque qu'à l'événement suivant."""
+    if wait_seconds > SAVE_INTERVAL_SECONDS and _SAVE_STATE["pending"]:
+        flush_events(events, (), force=True)
+
+# Lignes console en attente et date du dernier affichage
+_CONSOLE_STATE = {"lines": [], "last_write": 0.0}
+
+def console(line, force=False):
+    """Met une ligne en attente d'affichage : écriture groupée si le lot est
+    plein, si le délai est dépassé ou si force=True (messages importants)."""
+    state = _CONSOLE_STATE
+    lines = state["lines"]
+    lines.append(line + "\n")
+    if not force and len(lines) < CONSOLE_BATCH_SIZE \
+            and time.time() - state["last_write"] <= CONSOLE_INTERVAL_SECONDS:
+        return
+    flush_console()
+
+def flush_console():
+    state = _CONSOLE_STATE
+    if state["lines"]:
+        sys.stdout.write("".join(state["lines"]))
+        sys.stdout.flush()
+        state["lines"].clear()
+    state["last_write"] = time.time()
+
+def schedule_next(next_wake, delay):
+    """Échéance suivante (time.monotonic) : delay après la précédente, pour que
+    le temps passé à générer, écrire ou afficher soit décompté de la pause."""
+    return max(next_wake, time.monotonic() - MAX_CATCHUP_SECONDS) + delay
+
+def sleep_until(deadline):
+    """Dort jusqu'à l'échéance ; si elle est déjà passée, la boucle enchaîne
+    directement et rattrape son retard."""
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+# Probabilités de chaque type d'itération (chaque test s'applique si les
+# précédents ont échoué), converties en seuils cumulés pour un seul tirage
+P_BURST = 0.08
+P_MODERATE = 0.15
+P_ATTACK = 0.35
+T_BURST = P_BURST
+T_MODERATE = T_BURST + (1 - T_BURST) * P_MODERATE
+T_ATTACK = T_MODERATE + (1 - T_MODERATE) * P_ATTACK
+
 def generate_live_logs():
     print("=" * 70)
     print("🚀 Générateur de logs - Version IP uniquement")
     print("📊 Agrégation et scoring par IP")
     print("=" * 70)
     
-    events = load_json(EVENTS_FILE)
-    if not isinstance(events, list):
-        events = []
-
-    now = dt.now()
+    # Historique repris puis réécrit en JSONL (migre aussi l'ancien events.json)
+    # deque bornée : ajout en O(1), les plus anciens événements sortent seuls
+    events = deque(iter_events(), maxlen=MAX_EVENTS)
+    rewrite_events_file(events)
+
+    # Horloge simulée en millisecondes epoch (entier : pas de dérive flottante),
+    # convertie en datetime seulement pour formater l'événement
+    now_ms = time.time_ns() // 1_000_000
     iteration = 0
+    next_wake = time.monotonic()
+    # Méthodes du générateur aléatoire liées une fois (pas de lookup par tirage)
+    rnd, choice, randint, uniform = random.random, random.choice, random.randint, random.uniform
 
     try:
         while True:
             iteration += 1
-
-            if random.random() < 0.08:
-                events = generate_credential_stuffing_burst(events, attempts=random.randint(30, 70))
-                if len(events) > 2000:
-                    events = events[-2000:]
-                save_json(EVENTS_FILE, events)
-                detect_threats_by_ip(events)
-                print("🔴 CRITICAL : credential stuffing massif")
-                time.sleep(random.uniform(1.5, 3.0))
+            r = rnd()
+
+            if r < T_BURST:
+                burst = generate_credential_stuffing_burst([], attempts=randint(30, 70))
+                events.extend(burst)
+                flush_events(events, burst, force=True)
+                submit_detection(events)
+                console("🔴 CRITICAL : credential stuffing massif", force=True)
+                next_wake = schedule_next(next_wake, uniform(1.5, 3.0))
+                sleep_until(next_wake)
                 continue
 
-            if random.random() < 0.15:
-                events = generate_moderate_attack(events, attempts=random.randint(10, 18))
-                if len(events) > 2000:
-                    events = events[-2000:]
-                save_json(EVENTS_FILE, events)
-                detect_threats_by_ip(events)
-                print("🟡 MEDIUM : attaque modérée")
-                time.sleep(random.uniform(1.0, 2.0))
+            if r < T_MODERATE:
+                burst = generate_moderate_attack([], attempts=randint(10, 18))
+                events.extend(burst)
+                flush_events(events, burst, force=True)
+                submit_detection(events)
+                console("🟡 MEDIUM : attaque modérée", force=True)
+                next_wake = schedule_next(next_wake, uniform(1.0, 2.0))
+                sleep_until(next_wake)
                 continue
 
-            if random.random() < 0.35:
+            if r < T_ATTACK:
                 ip, country = random_public_ip()
-                user = random.choice(HIGH_VALUE_TARGETS + LEGIT_USERS)
-                ua = random.choice(USER_AGENTS_BOTS if random.random() < 0.85 else USER_AGENTS_HUMANS)
-                status = "FAIL" if random.random() < 0.9 else "SUCCESS"
-                sleep = random.uniform(0.05, 0.6)
+                user = choice(USERS_POOL)
+                ua = choice(UA_POOLS[rnd() < 0.85])
+                status = "FAIL" if rnd() < 0.9 else "SUCCESS"
+                sleep = uniform(0.05, 0.6)
             else:
-                if random.random() < 0.6:
+                if rnd() < 0.6:
                     ip, country = random_public_ip()
                 else:
-                    ip = random.choice(LOCAL_IPS)
+                    ip = choice(LOCAL_IPS)
                     country = "LAN"
-                user = random.choice(LEGIT_USERS)
-                ua = random.choice(USER_AGENTS_HUMANS)
-                status = "SUCCESS" if random.random() > 0.15 else "FAIL"
-                sleep = random.uniform(0.6, 5.0)
-
-            now += timedelta(milliseconds=random.randint(50, 1200))
-            event = {
-                "date": now.strftime("%Y-%m-%d"),
-                "time": now.strftime("%H:%M:%S.%f")[:-3],
-                "ip": ip,
-                "user": user,
-                "status": status,
-                "ua": ua,
-                "country": country
-            }
+                user = choice(LEGIT_USERS)
+                ua = choice(USER_AGENTS_HUMANS)
+                status = "SUCCESS" if rnd() > 0.15 else "FAIL"
+                sleep = uniform(0.6, 5.0)
 
-            events.append(event)
-            if len(events) > 2000:
-                events = events[-2000:]
-            save_json(EVENTS_FILE, events)
+            now_ms += randint(50, 1200)
+            stamp = dt.fromtimestamp(now_ms / 1000).isoformat(sep=" ", timespec="milliseconds")
+            event = emit_event(events, stamp, ip, user, status, ua, country, is_suspicious_ua(ua))
 
             if iteration % 8 == 0:
-                detect_threats_by_ip(events)
+                flush_events(events, [event], force=True)
+                submit_detection(events)
+            else:
+                flush_events(events, [event])
 
             status_icon = "✅" if status == "SUCCESS" else "❌"
-            print(f"{status_icon} | {event['date']} {event['time']} | {ip:15s} | {user:12s} | {status:7s} | {country}")
-            time.sleep(sleep)
+            console(f"{status_icon} | {event['date']} {event['time']} | {ip:15s} | {user:12s} | {status:7s} | {country}")
+            next_wake = schedule_next(next_wake, sleep)
+            wait_seconds = next_wake - time.monotonic()
+            flush_before_wait(events, wait_seconds)
+            if wait_seconds > CONSOLE_INTERVAL_SECONDS:
+                flush_console()   # pas de lignes en retard pendant une longue pause
+            sleep_until(next_wake)
 
     except KeyboardInterrupt:
+        flush_console()
         print("\n" + "=" * 30)
         print("🛑 Génération arrêtée")
         print("=" * 30)
-        save_json(EVENTS_FILE, events)
+        # Réécriture complète : inclut aussi un événement pas encore journalisé
+        if not rewrite_events_file(events):
+            flush_events(events, (), force=True)
+        wait_detection()
 
 if __name__ == "__main__":
     generate_live_logs()
\ No newline at end of file